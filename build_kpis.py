@@ -0,0 +1,29 @@
+import pandas as pd
+
+def build_kpis(prov_df=None):
+    # process_provider_data passes its target-county frame in; run standalone, it re-reads that output
+    if prov_df is None:
+        print("Loading detailed provider data...")
+        prov_df = pd.read_csv('outputs/provider_data_detailed.csv', engine='pyarrow')
+
+    # Pre-aggregate provider KPIs per county and specialty so the dashboard
+    # only has to filter and sum a small table instead of every provider row
+    keys = ['county', 'Rndrng_Prvdr_Type']
+    spec_sums = prov_df.groupby(keys)[['Tot_Mdcr_Pymt_Amt', 'Tot_Benes']].sum()
+    # Count NPIs with one hash table over the deduped pairs rather than a set per group (nunique)
+    npi_counts = prov_df[keys + ['Rndrng_NPI']].drop_duplicates().groupby(keys).size()
+    spec_metrics_by_county = spec_sums.assign(unique_NPIs=npi_counts).reset_index()
+    print(f"County/specialty combinations: {len(spec_metrics_by_county)}")
+
+    # Sum at full precision above, then store compact dtypes (counts fit in int32)
+    spec_metrics_by_county = spec_metrics_by_county.astype({
+        'Tot_Mdcr_Pymt_Amt': 'float32',
+        'Tot_Benes': 'int32',
+        'unique_NPIs': 'int32',
+    })
+
+    spec_metrics_by_county.to_parquet('outputs/spec_metrics_by_county.parquet', engine='pyarrow', compression='zstd', index=False)
+    print("Saved county/specialty KPIs to 'outputs/spec_metrics_by_county.parquet'")
+
+if __name__ == "__main__":
+    build_kpis()
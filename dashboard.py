@@ -1,10 +1,11 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import openpyxl
+import numpy as np
 from urllib.request import urlopen
 import json
+import os
+import pickle
+from typing import NamedTuple
 
 # -----------------------------------------------------------------------------
 # Page Configuration
@@ -53,44 +54,202 @@ st.markdown("""
 # -----------------------------------------------------------------------------
 @st.cache_data
 def load_data():
-    """Lengths the combined enrollment data from Excel."""
-    file_path = 'outputs/Combined enrollment.xlsx'
+    """Loads the combined enrollment data from Parquet."""
+    file_path = 'outputs/Combined enrollment.parquet'
     try:
-        df = pd.read_excel(file_path, engine='openpyxl')
-        df['DATE'] = pd.to_datetime(df['DATE'])
+        # DATE is already stored as a datetime and ENROLLED as int32, so no casting is needed here
+        df = pd.read_parquet(file_path, engine='pyarrow', columns=['DATE', 'COUNTY', 'ENROLLED'])
+        # Group on integer codes rather than strings
+        df['COUNTY'] = df['COUNTY'].astype('category')
+        # Sorted DatetimeIndex so date filters are binary-search slices, not full scans
+        df = df.sort_values('DATE', kind='stable').set_index('DATE')
         return df
     except Exception as e:
         st.error(f"Error loading data: {e}")
         return pd.DataFrame()
 
-@st.cache_data
+@st.cache_resource
 def load_geojson():
-    """Loads CA Counties GeoJSON."""
-    url = 'https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/california-counties.geojson'
-    with urlopen(url) as response:
-        geojson = json.load(response)
-    return geojson
+    """Loads CA Counties GeoJSON, using a local copy in outputs/ when present.
+
+    Prefers the simplified file from simplify_geojson.py, which is much smaller for Plotly to send.
+    Cached as a resource (shared, not copied) since the result is never mutated.
+    Returns the GeoJSON plus the county names in it as a DataFrame.
+    """
+    simplified_path = 'outputs/ca_counties_min.geojson'
+    cache_path = 'outputs/ca_counties.geojson.pkl'
+    geojson = None
+    if os.path.exists(simplified_path):
+        with open(simplified_path) as f:
+            geojson = json.load(f)
+    elif os.path.exists(cache_path):
+        # An unreadable (e.g. truncated) cache is treated as a miss and rewritten below
+        try:
+            with open(cache_path, 'rb') as f:
+                geojson = pickle.load(f)
+        except Exception:
+            geojson = None
+
+    if geojson is None:
+        # Not cached yet: download once and save for future cold starts
+        url = 'https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/california-counties.geojson'
+        with urlopen(url) as response:
+            geojson = json.load(response)
+        # Write to a temp file and swap it in, so an interrupted write never leaves a broken cache;
+        # a failed write (e.g. read-only deploy) just means the next cold start downloads again
+        tmp_path = cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(geojson, f, protocol=5)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    # Extract all county names from GeoJSON
+    all_counties = [feature['properties']['name'] for feature in geojson['features']]
+    all_counties_df = pd.DataFrame({'COUNTY': all_counties})
+    return geojson, all_counties_df
+
+class ProviderFrames(NamedTuple):
+    spec_county_df: pd.DataFrame
+    state_benchmarks: pd.DataFrame
+    ma_enrl_df: pd.DataFrame
+
+@st.cache_data
+def load_provider_frames():
+    """Loads provider KPIs by county/specialty, state benchmarks and MA county enrollment from Parquet."""
+    # Pre-aggregated by build_kpis.py (run by process_provider_data.py), so the page only sums a small table
+    spec_county_df = pd.read_parquet('outputs/spec_metrics_by_county.parquet')
+    # Low-cardinality columns used for filtering and grouping
+    spec_county_df['Rndrng_Prvdr_Type'] = spec_county_df['Rndrng_Prvdr_Type'].astype('category')
+    spec_county_df['county'] = spec_county_df['county'].astype('category')
+    # Indexed by specialty so the benchmark chart can join on the index
+    state_benchmarks = pd.read_parquet('outputs/kpi_state_benchmarks.parquet', columns=['Rndrng_Prvdr_Type', 'State_Avg_Cost']).set_index('Rndrng_Prvdr_Type')
+    # MA Enrollment for Gap Analysis
+    ma_enrl_df = pd.read_parquet('outputs/ma_county_enrollment.parquet')
+    return ProviderFrames(spec_county_df, state_benchmarks, ma_enrl_df)
+
+@st.cache_data
+def load_national_frames():
+    """Loads national provider stats and national MA enrollment from Parquet."""
+    nat_stats = pd.read_parquet('outputs/national_stats.parquet')
+    nat_enrl = pd.read_parquet('outputs/MA_Enrollment_National.parquet')
+    return nat_stats, nat_enrl
 
 # -----------------------------------------------------------------------------
 # Data Processing
 # -----------------------------------------------------------------------------
+def safe_divide(num, den):
+    """Divides two columns element-wise, giving 0 instead of inf/NaN where the denominator is not positive."""
+    num = num.to_numpy()
+    den = den.to_numpy()
+    out = np.zeros(len(num), dtype=np.result_type(num, den, np.float32))
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
 def process_data(df):
     """Aggregates data for the stacked bar chart."""
     if df.empty:
         return df, []
 
-    # Rank by total enrollment sum across all dates.
-    county_totals = df.groupby('COUNTY')['ENROLLED'].sum().sort_values(ascending=False)
-    top_counties = county_totals.head(7).index.tolist()
-    
-    # Assign group
-    df['County_Grouped'] = df['COUNTY'].apply(lambda x: x if x in top_counties else 'Others')
+    # Rank by total enrollment sum across all dates (nlargest avoids a full sort).
+    county_totals = df.groupby('COUNTY', observed=True)['ENROLLED'].sum()
+    top_counties = county_totals.nlargest(7).index.tolist()
     
-    # Aggregate
-    df_grouped = df.groupby(['DATE', 'County_Grouped'])['ENROLLED'].sum().reset_index()
+    # Assign group and aggregate in a single pass over the filtered frame.
+    # np.where is used because Series.where cannot add 'Others' to a categorical.
+    top_set = frozenset(top_counties)
+    grouped_col = np.where(df['COUNTY'].isin(top_set), df['COUNTY'].to_numpy(), 'Others')
+    df_grouped = (
+        df.assign(County_Grouped=grouped_col)
+          .groupby(['DATE', 'County_Grouped'], observed=True)['ENROLLED']
+          .sum()
+          .reset_index()
+    )
     
     return df_grouped, top_counties
 
+@st.cache_data
+def get_chart_data(start_date, end_date):
+    """Filters enrollment to a date range and aggregates it for the stacked bar chart."""
+    df = load_data()
+    filtered_df = df.loc[pd.to_datetime(start_date):pd.to_datetime(end_date)].reset_index()
+    return process_data(filtered_df)
+
+@st.cache_data
+def enrollment_bar_fig(start_date, end_date):
+    """Builds the Enrollment Trends stacked bar chart and returns it as a plain figure dict."""
+    import plotly.express as px
+
+    # Filter on date and aggregate (cached per date range)
+    chart_data, top_counties = get_chart_data(start_date, end_date)
+    
+    fig_bar = px.bar(
+        chart_data,
+        x='DATE',
+        y='ENROLLED',
+        color='County_Grouped',
+        title="Enrollment Growth",
+        template="plotly_dark",
+        labels={
+            'ENROLLED': 'Enrolled Members', 
+            'DATE': 'Year Mth',
+            'County_Grouped': 'County'
+        }, 
+        hover_data={
+            "DATE": "|%b %Y",
+            "ENROLLED": ":,",
+            "County_Grouped": True
+        },
+        color_discrete_sequence=px.colors.qualitative.Pastel,
+        category_orders={"County_Grouped": top_counties + ["Others"]}
+    )
+    
+    fig_bar.update_layout(
+        legend_title_text='County',
+        xaxis_title="Date",
+        yaxis_title="Enrolled Members",
+        hovermode="x unified",
+        margin=dict(l=0, r=0, t=40, b=0),
+        height=600
+    )
+    
+    return fig_bar.to_dict()
+
+@st.cache_data
+def map_frame_for_date(selected_date):
+    """Builds enrollment by county for one date, with every GeoJSON county present."""
+    df = load_data()
+    _, all_counties_df = load_geojson()
+    latest_df = df.loc[[selected_date], ['COUNTY', 'ENROLLED']]
+    # Left join so counties with no enrollment still appear on the map (as 0)
+    map_data = all_counties_df.merge(latest_df, on='COUNTY', how='left').fillna({'ENROLLED': 0})
+    # Pre-format hover text once here instead of per point in the browser
+    map_data['hover'] = (
+        'County=' + map_data['COUNTY'].astype(str)
+        + '<br>Enrolled Members=' + map_data['ENROLLED'].map('{:,.0f}'.format)
+    )
+    return map_data
+
+@st.cache_data
+def get_specialty_metrics(counties):
+    """Aggregates spend, benes and avg cost per bene by specialty for a sorted tuple of counties."""
+    spec_county_df = load_provider_frames().spec_county_df
+    filtered_prov = spec_county_df[spec_county_df['county'].isin(counties)]
+    
+    # Group by Specialty
+    spec_metrics = filtered_prov.groupby('Rndrng_Prvdr_Type', observed=True)[['Tot_Mdcr_Pymt_Amt', 'Tot_Benes']].sum().reset_index()
+    
+    # Calculate Intensity (Avg Cost per Bene)
+    spec_metrics['Avg_Cost_Per_Bene'] = safe_divide(spec_metrics['Tot_Mdcr_Pymt_Amt'], spec_metrics['Tot_Benes'])
+    
+    # Filter to relevant specialties (e.g., Top 20 by Spend); the top 10 of these are the high-volume specialties
+    top_spec_metrics = spec_metrics.sort_values('Tot_Mdcr_Pymt_Amt', ascending=False).head(20)
+    top_vol_specs = top_spec_metrics['Rndrng_Prvdr_Type'].head(10).tolist()
+    
+    return spec_metrics, top_spec_metrics, top_vol_specs
+
 # -----------------------------------------------------------------------------
 # Main Dashboard
 # -----------------------------------------------------------------------------
@@ -146,8 +305,8 @@ def main():
         st.markdown("Visualize enrollment growth over time by county.")
 
         # Optional: Date Range Filter
-        min_date = df['DATE'].min()
-        max_date = df['DATE'].max()
+        min_date = df.index.min()
+        max_date = df.index.max()
         
         start_date, end_date = st.sidebar.date_input(
             "Select Date Range",
@@ -156,84 +315,42 @@ def main():
             max_value=max_date
         )
         
-        # Filter data based on date
-        mask = (df['DATE'] >= pd.to_datetime(start_date)) & (df['DATE'] <= pd.to_datetime(end_date))
-        filtered_df = df.loc[mask]
-
         st.subheader("📊 Enrollment Over Time by County")
         
-        chart_data, top_counties = process_data(filtered_df)
-        
-        fig_bar = px.bar(
-            chart_data,
-            x='DATE',
-            y='ENROLLED',
-            color='County_Grouped',
-            title="Enrollment Growth",
-            template="plotly_dark",
-            labels={
-                'ENROLLED': 'Enrolled Members', 
-                'DATE': 'Year Mth',
-                'County_Grouped': 'County'
-            }, 
-            hover_data={
-                "DATE": "|%b %Y",
-                "ENROLLED": ":,",
-                "County_Grouped": True
-            },
-            color_discrete_sequence=px.colors.qualitative.Pastel,
-            category_orders={"County_Grouped": top_counties + ["Others"]}
-        )
-        
-        fig_bar.update_layout(
-            legend_title_text='County',
-            xaxis_title="Date",
-            yaxis_title="Enrolled Members",
-            hovermode="x unified",
-            margin=dict(l=0, r=0, t=40, b=0),
-            height=600
-        )
-        
-        st.plotly_chart(fig_bar, use_container_width=True)
+        # Figure is built and serialized once per date range
+        st.plotly_chart(enrollment_bar_fig(start_date, end_date), use_container_width=True)
 
     # --- Page 3: Geographic Distribution ---
     elif page == "Geographic Distribution":
         if df.empty: return
+        # Plotly is imported per chart page so Methodology/Strategy don't pay for it
+        import plotly.express as px
         st.title("🗺️ Geographic Distribution")
         st.markdown("View enrollment by county across California.")
 
         # Slider for Date Selection
-        # Get unique dates sorted
-        dates = df['DATE'].sort_values().unique()
-        # Convert to datetime objects for display if needed, but slider works with timestamps
+        # Get unique dates sorted (the index is already sorted)
+        date_index = df.index.unique()
+        dates = date_index.to_numpy()
+        # Format all labels in one vectorized call rather than per option on every render
+        date_labels = dict(zip(dates, date_index.strftime('%b %Y')))
         
         # Select Slider
         selected_date = st.select_slider(
             "Select Date",
             options=dates,
-            format_func=lambda x: pd.to_datetime(x).strftime('%b %Y'),
+            format_func=date_labels.get,
             value=dates[-1] # Default to latest
         )
         
-        st.info(f"Showing data for: **{pd.to_datetime(selected_date).strftime('%B %Y')}**")
-        
-        # Filter for selected date
-        latest_df = df[df['DATE'] == selected_date]
+        st.info(f"Showing data for: **{pd.Timestamp(selected_date).strftime('%B %Y')}**")
         
         # Load GeoJSON to get ALL counties
         try:
-            geojson = load_geojson()
-            
-            # Extract all county names from GeoJSON
-            all_counties = [feature['properties']['name'] for feature in geojson['features']]
-            all_counties_df = pd.DataFrame({'COUNTY': all_counties})
+            geojson, _ = load_geojson()
             
-            # Merge with enrollment data
-            # Use left join to ensure all counties are present
-            map_data = pd.merge(all_counties_df, latest_df, on='COUNTY', how='left')
-            
-            # Fill NaN values with 0 for enrollment
-            map_data['ENROLLED'] = map_data['ENROLLED'].fillna(0)
+            # Enrollment for every county on the selected date (cached per date)
+            map_data = map_frame_for_date(selected_date)
             
             # Calculate global range for consistent coloring
             max_enrolled = df['ENROLLED'].max()
@@ -247,14 +364,15 @@ def main():
                 color_continuous_scale="Viridis",
                 range_color=[0, max_enrolled], # Fixed scale
                 scope="usa", 
-                title=f"Enrollment by County ({pd.to_datetime(selected_date).strftime('%b %Y')})",
+                title=f"Enrollment by County ({date_labels[selected_date]})",
                 template="plotly_dark",
                 labels={
                     'COUNTY': 'County',
                     'ENROLLED': 'Enrolled Members'
                 },
-                hover_data={"COUNTY": True, "ENROLLED": ":,"}
+                custom_data=['hover']
             )
+            fig_map.update_traces(hovertemplate="%{customdata[0]}<extra></extra>")
             
             # center on CA and zoom in
             fig_map.update_geos(fitbounds="locations", visible=False)
@@ -267,25 +385,23 @@ def main():
             
         except Exception as e:
             st.error(f"Could not load map: {e}")
-            st.dataframe(latest_df)
+            st.dataframe(df.loc[[selected_date]].reset_index())
 
     # --- Page 4: Provider Insights ---
     elif page == "Provider Insights":
+        import plotly.express as px
         st.title("🩺 Provider Network Insights")
         st.markdown("Strategic assessment of Medicare providers in key PACE counties.")
         
-        # Load detailed data and benchmarks
+        # Load KPI data and benchmarks
         try:
-            prov_df = pd.read_csv('outputs/provider_data_detailed.csv')
-            state_benchmarks = pd.read_csv('outputs/kpi_state_benchmarks.csv')
-            # Load MA Enrollment for Gap Analysis
-            ma_enrl_df = pd.read_csv('outputs/ma_county_enrollment.csv')
+            frames = load_provider_frames()
         except FileNotFoundError:
             st.error("KPI Data not found. Please run `process_provider_data.py` first.")
             return
 
         # --- Interactivity: County Filter ---
-        available_counties = sorted(prov_df['county'].unique())
+        available_counties = sorted(frames.spec_county_df['county'].unique())
         selected_counties = st.multiselect(
             "Filter by County",
             options=available_counties,
@@ -297,19 +413,22 @@ def main():
             st.warning("Please select at least one county.")
             return
 
-        # Filter Data
-        filtered_prov = prov_df[prov_df['county'].isin(selected_counties)]
+        # Filter Data (one row per county/specialty)
+        filtered_prov = frames.spec_county_df[frames.spec_county_df['county'].isin(selected_counties)]
         
         # --- DYNAMIC CALCS ---
         
+        # Specialty metrics (shared by the KPI cards and the charts below, cached per county selection)
+        spec_metrics, top_spec_metrics, top_vol_specs = get_specialty_metrics(tuple(sorted(selected_counties)))
+        
         # 1. KPI Cards
         col1, col2, col3 = st.columns(3)
         total_spend = filtered_prov['Tot_Mdcr_Pymt_Amt'].sum()
         total_benes = filtered_prov['Tot_Benes'].sum()
         
         # Top specialty in selection
-        if not filtered_prov.empty:
-            top_spec = filtered_prov.groupby('Rndrng_Prvdr_Type')['Tot_Mdcr_Pymt_Amt'].sum().idxmax()
+        if not top_spec_metrics.empty:
+            top_spec = top_spec_metrics['Rndrng_Prvdr_Type'].iloc[0]
         else:
             top_spec = "N/A"
             
@@ -330,15 +449,6 @@ def main():
         st.subheader("Specialty Landscapes: Volume vs. Intensity")
         st.markdown("**Size of Bubble = Total Medicare Spend**")
         
-        # Group by Specialty
-        spec_metrics = filtered_prov.groupby('Rndrng_Prvdr_Type')[['Tot_Mdcr_Pymt_Amt', 'Tot_Benes']].sum().reset_index()
-        
-        # Calculate Intensity (Avg Cost per Bene)
-        spec_metrics['Avg_Cost_Per_Bene'] = spec_metrics['Tot_Mdcr_Pymt_Amt'] / spec_metrics['Tot_Benes']
-        
-        # Filter to relevant specialties (e.g., Top 20 by Spend)
-        top_spec_metrics = spec_metrics.sort_values('Tot_Mdcr_Pymt_Amt', ascending=False).head(20)
-        
         fig_spec = px.scatter(
             top_spec_metrics,
             x='Tot_Benes',
@@ -381,23 +491,18 @@ def main():
         st.subheader("💰 Cost Benchmarks: Selected Counties vs CA Avg")
         st.markdown("Comparison for Top 10 High-Volume Specialties")
         
-        # Filter Benchmarks to Top 10 by VOLUME
-        top_vol_specs = spec_metrics.sort_values('Tot_Mdcr_Pymt_Amt', ascending=False).head(10)['Rndrng_Prvdr_Type'].tolist()
-        
-        # Calculate local avg cost per bene
-        spec_metrics['Selected_Avg_Cost'] = spec_metrics['Tot_Mdcr_Pymt_Amt'] / spec_metrics['Tot_Benes']
-        
-        # Merge with State Benchmarks
-        bench_df = pd.merge(spec_metrics[['Rndrng_Prvdr_Type', 'Selected_Avg_Cost']], 
-                            state_benchmarks, 
-                            on='Rndrng_Prvdr_Type', how='inner')
-        
-        # Filter to top volume specs
-        bench_df = bench_df[bench_df['Rndrng_Prvdr_Type'].isin(top_vol_specs)]
+        # Filter to top volume specs and join local avg cost per bene with State Benchmarks on the index
+        # (intersection keeps spec_metrics' alphabetical order for the bars)
+        local_costs = spec_metrics.set_index('Rndrng_Prvdr_Type')[['Avg_Cost_Per_Bene']]
+        bench_df = (
+            local_costs.loc[local_costs.index.intersection(top_vol_specs)]
+                       .join(frames.state_benchmarks, how='inner')
+                       .reset_index()
+        )
         
         # Melt for plot
         bench_melt = bench_df.melt(id_vars='Rndrng_Prvdr_Type', 
-                                   value_vars=['Selected_Avg_Cost', 'State_Avg_Cost'],
+                                   value_vars=['Avg_Cost_Per_Bene', 'State_Avg_Cost'],
                                    var_name='Metric', value_name='Cost_Per_Bene')
         
         fig_bench = px.bar(
@@ -412,7 +517,7 @@ def main():
                 'Cost_Per_Bene': 'Avg Cost ($)', 
                 'Rndrng_Prvdr_Type': 'Specialty',
                 'State_Avg_Cost': 'State Avg Cost ($)',
-                'Selected_Avg_Cost': 'Counties Avg Cost ($)'
+                'Avg_Cost_Per_Bene': 'Counties Avg Cost ($)'
                 }
         )
 
@@ -427,7 +532,7 @@ def main():
         fig_bench.for_each_trace(
             lambda t: t.update(
                 name="Selected Counties Avg"
-                if t.name == "Selected_Avg_Cost"
+                if t.name == "Avg_Cost_Per_Bene"
                 else "CA State Avg"
             )
         )
@@ -454,16 +559,15 @@ def main():
             title_suffix = f"({selected_gap_spec})"
         
         # Calculate Provider Counts per County (in selection)
-        prov_counts = gap_filtered_prov.groupby('county')['Rndrng_NPI'].nunique().reset_index(name='Provider_Count')
+        # Each NPI appears once in the provider file, so per-specialty unique counts add up per county
+        prov_counts = gap_filtered_prov.groupby('county', observed=True)['unique_NPIs'].sum().reset_index(name='Provider_Count')
         
         # Merge with Total MA Enrollment
-        gap_df = pd.merge(prov_counts, ma_enrl_df, left_on='county', right_on='COUNTY', how='left')
-        gap_df['MA_ENROLLED'] = gap_df['MA_ENROLLED'].fillna(0) # Avoid div by zero issues if any
+        gap_df = pd.merge(prov_counts, frames.ma_enrl_df, left_on='county', right_on='COUNTY', how='left')
+        gap_df['MA_ENROLLED'] = gap_df['MA_ENROLLED'].fillna(0)
         
-        # Calc Density
-        gap_df['Providers_Per_100_MA_Enrolled'] = (gap_df['Provider_Count'] / gap_df['MA_ENROLLED']) * 100
-        # Handle Inf if enrollment is 0
-        gap_df = gap_df[gap_df['MA_ENROLLED'] > 0]
+        # Calc Density (0 where there is no MA enrollment, rather than inf)
+        gap_df['Providers_Per_100_MA_Enrolled'] = safe_divide(gap_df['Provider_Count'], gap_df['MA_ENROLLED']) * 100
         
         gap_df = gap_df.sort_values('Providers_Per_100_MA_Enrolled', ascending=True)
         
@@ -491,10 +595,9 @@ def main():
         # Only if "All Specialties" is selected (since we only calc national total count)
         if selected_gap_spec == "All Specialties":
             try:
-                nat_stats = pd.read_csv('outputs/national_stats.csv')
+                nat_stats, nat_enrl = load_national_frames()
                 nat_prov_count = nat_stats.loc[nat_stats['Metric'] == 'National_Provider_Count', 'Value'].values[0]
                 
-                nat_enrl = pd.read_csv('outputs/MA_Enrollment_National.csv')
                 latest_nat_enrl = nat_enrl.sort_values('DATE').iloc[-1]['NATIONAL_MA_ENROLLED']
                 
                 nat_density = (nat_prov_count / latest_nat_enrl) * 100
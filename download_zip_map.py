@@ -1,37 +1,32 @@
 import pandas as pd
-import requests
-import io
 
 def download_zip_mapping():
     url = "https://raw.githubusercontent.com/scpike/us-state-county-zip/master/geo-data.csv"
     try:
         print(f"Downloading data from {url}...")
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        # Read into dataframe
-        df = pd.read_csv(io.StringIO(response.text))
-        
-        # Filter for CA
-        # The columns seem to be state_fips,state,state_abbr,zipcode,county,city
-        # Let's check headers if possible, but based on repo description:
-        # state_fips,state,state_abbr,zipcode,county,city
-        
-        # If headers are different, we might need to adjust. Let's inspect first few lines
+        # Columns are state_fips,state,state_abbr,zipcode,county,city ('state' is the full name).
+        # Let pandas stream-parse the URL directly and only keep what is needed.
+        # The C engine is used because the pyarrow engine parses zipcode as an integer before
+        # applying the dtype, which drops leading zeros ('01001' -> '1001').
+        df = pd.read_csv(
+            url,
+            usecols=['state', 'state_abbr', 'zipcode', 'county', 'city'],
+            dtype={'state': 'category', 'state_abbr': 'category', 'zipcode': 'string'}
+        )
         print("Columns:", df.columns.tolist())
-        
-        ca_df = df[df['state'] == 'CA'].copy() # attempting 'state' or 'state_abbr'
-        if ca_df.empty:
-             ca_df = df[df['state_abbr'] == 'CA'].copy()
-        
+
+        # Filter for CA
+        ca_df = df[df['state_abbr'].eq('CA')]
+
         if ca_df.empty:
             print("Could not filter for CA. Check column names.")
             print(df.head())
             return
 
-        # Save to csv
+        # Save to csv and parquet
         ca_df.to_csv('outputs/ca_zip_county.csv', index=False)
-        print("Saved CA zip mapping to outputs/ca_zip_county.csv")
+        ca_df.to_parquet('outputs/ca_zip_county.parquet', index=False)
+        print("Saved CA zip mapping to outputs/ca_zip_county.csv and outputs/ca_zip_county.parquet")
         print(ca_df.head())
 
     except Exception as e:
@@ -1,141 +1,234 @@
 ## SCRIPT TO DOWNLOAD AND PROCESS ALL CMS ENROLLMENT FILES AND COMBINE THEM INTO ONE FILE
 
-import pandas as pd
+import polars as pl
 import requests
 import zipfile
 import os
+import shutil
 import glob
+import json
 import re
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from dicts.enrollment_dicts import enrl_file_dict
 
 # Get current working directory from parentfolder of folder containing scripts
 directory = os.getcwd()
 
+# Shared session so downloads reuse pooled keep-alive connections to cms.gov
+session = requests.Session()
+
+# Version of a file on cms.gov, used to tell whether a saved zip is still current
+def _version_of(response):
+    return response.headers.get('ETag') or response.headers.get('Last-Modified')
+
+# Check with a HEAD request whether cms.gov has replaced a zip we already have
+def _needs_refresh(url, version_path):
+    # Without a saved version there is nothing to compare against, so keep the existing copy
+    if not os.path.exists(version_path):
+        return False
+    with open(version_path) as fh:
+        saved_version = fh.read()
+    try:
+        response = session.head(url, allow_redirects=True)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as err:
+        print(f"Could not check {url} for updates, keeping existing file: {err}")
+        return False
+    # A HEAD response without ETag/Last-Modified can't show a change, so keep the existing copy
+    current_version = _version_of(response)
+    return current_version is not None and current_version != saved_version
+
+# Download a single month's enrollment zip from the CMS website
+# Returns the zip path and whether it was freshly downloaded, or None if the download failed
+def _download_one(file):
+    file_name = enrl_file_dict[file]
+    print(f'Downloading enrollment for: {file_name}')
+
+    save_path = directory + fr'\raw_data\enrollment\{file}'
+    print(save_path)
+    os.makedirs(save_path, exist_ok=True)
+    # Downloads land here first and only replace the zip once complete, so a dropped connection never leaves a truncated zip
+    part_path = os.path.join(save_path, file_name) + '.part'
+
+    try:
+        # Set CMS url
+        if int(file) >= 202510 or file == '202307':
+            url = 'https://www.cms.gov/files/zip/' + file_name
+        else:
+            url = 'https://www.cms.gov/files/zip/ma-enrollment-state/county/' + file_name
+
+        print(url)
+        # Define the complete path including the file name
+        complete_save_path = os.path.join(save_path, file_name)
+        # ETag/Last-Modified of the downloaded copy is kept next to the zip
+        version_path = complete_save_path + '.etag'
+
+        if os.path.exists(complete_save_path) and not _needs_refresh(url, version_path):
+            print(f"File already exists at {complete_save_path}")
+            return complete_save_path, False
+
+        # Send the HTTP request and stream the content to disk in 1 MB chunks
+        # rather than holding the whole zip in memory
+        with session.get(url, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            with open(part_path, 'wb') as fh:
+                shutil.copyfileobj(response.raw, fh, length=1024 * 1024)
+            version = _version_of(response)
+        os.replace(part_path, complete_save_path)
+        if version:
+            with open(version_path, 'w') as fh:
+                fh.write(version)
+        print(f"File successfully downloaded and saved to {complete_save_path}")
+        return complete_save_path, True
+
+    except requests.exceptions.HTTPError as http_err:
+        print(f"HTTP error occurred: {http_err}")
+    except Exception as err:
+        print(f"An error occurred: {err}")
+    finally:
+        # Only left behind if the download failed part way
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+# Unzip a downloaded enrollment zip next to itself
+def _unzip_one(complete_save_path, downloaded):
+    # Define the extraction path
+    extract_path = os.path.dirname(complete_save_path)
+
+    try:
+        # Check if the zip file has already been unzipped (a fresh download is always re-extracted)
+        if not downloaded:
+            non_zip_files_exist = any(
+                entry for entry in os.scandir(extract_path)
+                if entry.is_file() and not entry.name.endswith(('.zip', '.etag', '.part'))
+            )
+            if non_zip_files_exist:
+                print(f"Files already extracted to {extract_path}")
+                return
+
+        # Check if the file is a zip file
+        if zipfile.is_zipfile(complete_save_path):
+            with zipfile.ZipFile(complete_save_path, 'r') as zip_ref:
+                zip_ref.extractall(extract_path)
+                print(f"File successfully unzipped to {extract_path}")
+        else:
+            print(f"{complete_save_path} is not a zip file")
+
+    except Exception as err:
+        print(f"An error occurred: {err}")
+
 # Create function to download and unzip pfs files from CMS website
 def download_and_unzip(file_list):
 
-    # Loop through the list of files and download and unzip each one
-    for file in file_list:
-        file_name = enrl_file_dict[file]
-        print(f'Downloading enrollment for: {file_name}')
-
-        save_path = directory + fr'\raw_data\enrollment\{file}'
-        print(save_path)
-        os.makedirs(save_path, exist_ok=True)
-
-        try:
-            # Set CMS url
-            if int(file) >= 202510 or file == '202307':
-                url = 'https://www.cms.gov/files/zip/' + file_name
-            else:
-                url = 'https://www.cms.gov/files/zip/ma-enrollment-state/county/' + file_name
-
-            # Send the HTTP request to download the file
-            print(url)
-            response = requests.get(url)
-            response.raise_for_status()
-            # Define the complete path including the file name
-            complete_save_path = os.path.join(save_path, file_name)
-
-            # Open the specified file path in binary write mode and save the content
-            if os.path.exists(complete_save_path):
-                print(f"File already exists at {complete_save_path}")
-            else:
-                with open(complete_save_path, 'wb') as file_name:
-                    file_name.write(response.content)
-                print(f"File successfully downloaded and saved to {complete_save_path}")
-
-            # Define the extraction path
-            extract_path = save_path
-            # Check if the zip file has already been unzipped
-            if os.path.exists(extract_path):
-                non_zip_files_exist = any(
-                    entry for entry in os.scandir(extract_path)
-                    if entry.is_file() and not entry.name.endswith('.zip')
-                )
-                if non_zip_files_exist:
-                    print(f"Files already extracted to {extract_path}")
-                    continue
-
-            # Check if the file is a zip file
-            if zipfile.is_zipfile(complete_save_path):
-                with zipfile.ZipFile(complete_save_path, 'r') as zip_ref:
-                    zip_ref.extractall(extract_path)
-                    print(f"File successfully unzipped to {extract_path}")
-            else:
-                print(f"{complete_save_path} is not a zip file")
-
-        except requests.exceptions.HTTPError as http_err:
-            print(f"HTTP error occurred: {http_err}")
-        except Exception as err:
-            print(f"An error occurred: {err}")
+    # Download the files concurrently; each one is dominated by network round trips
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        downloads = [d for d in executor.map(_download_one, file_list) if d is not None]
+
+    # Then unzip them concurrently; zlib releases the GIL while inflating, so threads run in parallel
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(lambda d: _unzip_one(*d), downloads))
+
+# Title-case source headers used by some months, mapped to the upper-case names used downstream
+ENROLLMENT_COLUMNS = {'State': 'STATE', 'County': 'COUNTY', 'Plan Type': 'PLAN TYPE', 'Enrolled': 'ENROLLED'}
+
+# Lazily scan one month's enrollment csv and tag it with its DATE
+def _scan_enrollment(enrl_file):
+    year = enrl_file[:4]
+    month = enrl_file[4:]
+
+    if enrl_file == '202312': name = f'SCC_Enrollment_MA_{year}_{month}'
+    else: name = f'SCP_Enrollment_MA_{year}_{month}'
+    file_name = (directory + f'/raw_data/enrollment/{enrl_file}/{name}/{name}.csv')
+
+    # Read every column as text; ENROLLED uses '.' and '*' for suppressed counts
+    lf = pl.scan_csv(file_name, infer_schema=False)
+
+    # Header case differs between months; months that are already upper case have nothing to rename
+    lf = lf.rename(ENROLLMENT_COLUMNS, strict=False)
+
+    # Limit to relevant columns and clean up suppressed enrolled values for calculation
+    # Contract-level rows are summed per county and plan type here, before the months are concatenated
+    return (
+        lf.select(
+            pl.col('STATE'),
+            pl.col('COUNTY'),
+            pl.col('PLAN TYPE'),
+            pl.col('ENROLLED').cast(pl.Float64, strict=False).fill_null(0),
+        )
+        .group_by(['STATE', 'COUNTY', 'PLAN TYPE'])
+        .agg(pl.col('ENROLLED').sum())
+        .select(
+            pl.col('STATE', 'COUNTY', 'PLAN TYPE'),
+            pl.lit(datetime(int(year), int(month), 1)).alias('DATE'),
+            pl.col('ENROLLED'),
+        )
+    )
 
 def clean_and_combine(file_list, states):
 
-    # Create empty dataframe for appending
-    combined_enrl = pd.DataFrame()
-    combined_total_ma = pd.DataFrame()
-    combined_national_ma = pd.DataFrame()
-
-    # Process each ratebooks file and combine
-    for enrl_file in file_list:
-        year = enrl_file[:4]
-        month = enrl_file[4:]
-        print(enrl_file)
-
-        # Read in csv
-        if enrl_file == '202312': name = f'SCC_Enrollment_MA_{year}_{month}'
-        else: name = f'SCP_Enrollment_MA_{year}_{month}'
-        file_name = (directory + f'/raw_data/enrollment/{enrl_file}/{name}/{name}.csv')
-        enrl_df = pd.read_csv(file_name)
-
-        # Process enrollment file
-        enrl_df.columns = enrl_df.columns.str.upper()
-
-        # Limit to relevant columns
-        keep_cols = ['STATE', 'COUNTY', 'PLAN TYPE', 'ENROLLED']
-        enrl_df = enrl_df[keep_cols]
-        
-        # Clean up zero enrolled values for calculation
-        enrl_df['ENROLLED'] = pd.to_numeric(enrl_df['ENROLLED'].replace('.',0), errors='coerce').fillna(0)
-        
-        # --- Process Total MA Enrollment (NATIONAL & STATE) ---
-        # 1. State Level (for CA)
-        state_ma_df = enrl_df[enrl_df['STATE'].isin(states)].groupby(['STATE', 'COUNTY'], as_index=False)['ENROLLED'].sum()
-        state_ma_df['DATE'] = pd.to_datetime(f"{year}-{month}-01")
-        combined_total_ma = pd.concat([combined_total_ma, state_ma_df], ignore_index=True)
-        
-        # 2. National Level
-        national_ma_sum = enrl_df['ENROLLED'].sum()
-        # Create a tiny DF to append
-        nat_df = pd.DataFrame({'DATE': [pd.to_datetime(f"{year}-{month}-01")], 'NATIONAL_MA_ENROLLED': [national_ma_sum]})
-        combined_national_ma = pd.concat([combined_national_ma, nat_df], ignore_index=True)
-        # -----------------------------------
-
-        # Limit to selected states and localities
-        enrl_df = enrl_df[enrl_df['STATE'].isin(states)]
-
-        # Limit to PACE
-        enrl_df = enrl_df[enrl_df['PLAN TYPE'] == 'National PACE']
-
-        # Create DATE column
-        enrl_df['DATE'] = pd.to_datetime(f"{year}-{month}-01")
-
-        # Create combined pfs df
-        combined_enrl = pd.concat([combined_enrl, enrl_df], ignore_index=True)
-        print(enrl_file + " enrollment file processed")
-
-    # Deal with duplicate rows by summing enrollment
-    combined_enrl = combined_enrl.groupby(['STATE', 'COUNTY', 'PLAN TYPE', 'DATE'], as_index=False)['ENROLLED'].sum()
-    combined_total_ma = combined_total_ma.groupby(['STATE', 'COUNTY', 'DATE'], as_index=False)['ENROLLED'].sum()
-    combined_national_ma = combined_national_ma.groupby('DATE', as_index=False)['NATIONAL_MA_ENROLLED'].sum()
-
-    # Save combined results
-    combined_enrl.to_excel(directory + r'\outputs\Combined enrollment.xlsx', index=False)
-    combined_total_ma.to_excel(directory + r'\outputs\MA_Enrollment_Total.xlsx', index=False)
+    # One lazy plan over every month's (already aggregated) file; nothing is read until collect
+    full = pl.concat([_scan_enrollment(enrl_file) for enrl_file in file_list])
+
+    # Limit to selected states (rows without a county are dropped, as pandas groupby did)
+    # A single state is a plain equality check rather than a set membership test
+    if len(states) == 1: in_states = pl.col('STATE') == states[0]
+    else: in_states = pl.col('STATE').is_in(states)
+    in_state_counties = in_states & pl.col('COUNTY').is_not_null()
+
+    # PACE enrollment; duplicate rows were already summed per month by _scan_enrollment
+    # State and plan type are checked in one fused predicate
+    pace_lf = (
+        full.filter(in_state_counties & (pl.col('PLAN TYPE') == 'National PACE'))
+        .sort(['STATE', 'COUNTY', 'PLAN TYPE', 'DATE'])
+    )
+
+    # --- Total MA Enrollment (NATIONAL & STATE) ---
+    # One county-level pass over every state; both tables below are cut from it
+    county_ma_lf = full.group_by(['STATE', 'COUNTY', 'DATE']).agg(pl.col('ENROLLED').sum())
+
+    # 1. State Level (for CA)
+    total_ma_lf = (
+        county_ma_lf.filter(in_state_counties)
+        .sort(['STATE', 'COUNTY', 'DATE'])
+    )
+
+    # 2. National Level (rows without a state or county still count here)
+    national_ma_lf = (
+        county_ma_lf.group_by('DATE')
+        .agg(pl.col('ENROLLED').sum().alias('NATIONAL_MA_ENROLLED'))
+        .sort('DATE')
+    )
+    # -----------------------------------
+
+    # Collect all three together so the csv scans are shared between them
+    pace_df, total_ma_df, national_ma_df = pl.collect_all([pace_lf, total_ma_lf, national_ma_lf], engine='streaming')
+    print(f"{len(file_list)} enrollment files processed")
+
+    combined_enrl = pace_df.to_pandas()
+    combined_total_ma = total_ma_df.to_pandas()
+    combined_national_ma = national_ma_df.to_pandas()
+
+    # Latest month's PACE enrollment per county, so process_provider_data doesn't re-read every month
+    latest_enrl = combined_enrl[combined_enrl['DATE'] == combined_enrl['DATE'].max()]
+    latest_county_enrl = latest_enrl.groupby('COUNTY', as_index=False)['ENROLLED'].sum()
+
+    # Top 10 counties by latest-month PACE enrollment, picked once here for process_provider_data and get_counties
+    top_counties = latest_county_enrl.nlargest(10, 'ENROLLED')['COUNTY'].tolist()
+
+    # Save combined results as Parquet (enrollment counts fit in int32)
+    combined_enrl.astype({'ENROLLED': 'int32'}).to_parquet(directory + r'\outputs\Combined enrollment.parquet', engine='pyarrow', compression='zstd', index=False)
+    combined_total_ma.astype({'ENROLLED': 'int32'}).to_parquet(directory + r'\outputs\MA_Enrollment_Total.parquet', engine='pyarrow', compression='zstd', index=False)
+    latest_county_enrl.astype({'ENROLLED': 'int32'}).to_parquet(directory + r'\outputs\latest_county_enrollment.parquet', engine='pyarrow', compression='zstd', index=False)
+    print("Saved combined enrollment to outputs/Combined enrollment.parquet, outputs/MA_Enrollment_Total.parquet and outputs/latest_county_enrollment.parquet")
     combined_national_ma.to_csv(directory + r'\outputs\MA_Enrollment_National.csv', index=False)
-    print("Saved National MA Enrollment to outputs/MA_Enrollment_National.csv")
+    combined_national_ma.astype({'NATIONAL_MA_ENROLLED': 'int64'}).to_parquet(directory + r'\outputs\MA_Enrollment_National.parquet', engine='pyarrow', compression='zstd', index=False)
+    print("Saved National MA Enrollment to outputs/MA_Enrollment_National.csv and outputs/MA_Enrollment_National.parquet")
+    with open(directory + r'\outputs\top_counties.json', 'w') as fh:
+        json.dump(top_counties, fh)
+    print(f"Saved Top 10 Counties to outputs/top_counties.json: {top_counties}")
     print(combined_enrl)
 
     return combined_enrl
\ No newline at end of file
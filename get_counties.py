@@ -1,13 +1,11 @@
-import pandas as pd
-import openpyxl
+import json
 
 def get_top_counties():
-    file_path = 'outputs/Combined enrollment.xlsx'
+    # Written by clean_and_combine from the latest month of PACE enrollment
+    file_path = 'outputs/top_counties.json'
     try:
-        df = pd.read_excel(file_path, engine='openpyxl')
-        # Sum enrollment by county
-        county_totals = df.groupby('COUNTY')['ENROLLED'].sum().sort_values(ascending=False)
-        top_counties = county_totals.head(10).index.tolist()
+        with open(file_path) as fh:
+            top_counties = json.load(fh)
         print("Top Counties:", top_counties)
         return top_counties
     except Exception as e:
@@ -1,24 +1,27 @@
 import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import json
 import os
 
+from build_kpis import build_kpis
+
 def process_provider_data():
     print("Loading data...")
-    # 1. Load Zip Mapping
-    zip_map = pd.read_csv('outputs/ca_zip_county.csv')
-    # Use Zip as string to ensure matching
-    zip_map['zipcode'] = zip_map['zipcode'].astype(str)
+    # 1. Zip Mapping
+    # zipcode is stored as a string by download_zip_map.py, so it matches the provider zips directly
+    zip_map_lf = pl.scan_parquet('outputs/ca_zip_county.parquet').select(['zipcode', 'county'])
     
     # 2. Load Enrollment Data to get Target Counties and Enrollment counts
     try:
-        enrollment_df = pd.read_excel('outputs/Combined enrollment.xlsx', engine='openpyxl')
-        # Get latest enrollment per county
-        latest_date = enrollment_df['DATE'].max()
-        latest_enrollment = enrollment_df[enrollment_df['DATE'] == latest_date]
-        # Summarize by County
-        county_enrollment = latest_enrollment.groupby('COUNTY')['ENROLLED'].sum().reset_index()
+        # Latest enrollment per county, already summarized by clean_and_combine
+        county_enrollment = pd.read_parquet('outputs/latest_county_enrollment.parquet')
         
-        # Identify Top 10 Counties
-        top_counties = county_enrollment.sort_values('ENROLLED', ascending=False).head(10)['COUNTY'].tolist()
+        # Top 10 Counties are picked once by clean_and_combine
+        with open('outputs/top_counties.json') as fh:
+            top_counties = json.load(fh)
         print(f"Top 10 Counties: {top_counties}")
         
     except Exception as e:
@@ -27,7 +30,7 @@ def process_provider_data():
 
     # 2b. Load Total MA Enrollment Data for Gap Analysis
     try:
-        ma_enrollment_df = pd.read_excel('outputs/MA_Enrollment_Total.xlsx', engine='openpyxl')
+        ma_enrollment_df = pd.read_parquet('outputs/MA_Enrollment_Total.parquet', columns=['DATE', 'COUNTY', 'ENROLLED'])
         # Get latest enrollment per county
         latest_ma_date = ma_enrollment_df['DATE'].max()
         latest_ma_enrollment = ma_enrollment_df[ma_enrollment_df['DATE'] == latest_ma_date]
@@ -35,14 +38,16 @@ def process_provider_data():
         ma_county_enrollment = latest_ma_enrollment.groupby('COUNTY')['ENROLLED'].sum().reset_index()
         ma_county_enrollment.rename(columns={'ENROLLED': 'MA_ENROLLED'}, inplace=True)
         
-        ma_county_enrollment.to_csv('outputs/ma_county_enrollment.csv', index=False)
-        print("Saved Total MA Enrollment to 'outputs/ma_county_enrollment.csv'")
-        
     except Exception as e:
         print(f"Error loading MA enrollment: {e}")
         # Use existing enrollment as fallback if MA file missing (should not happen if processed correctly)
-        county_enrollment.rename(columns={'ENROLLED': 'MA_ENROLLED'}, inplace=True)
-        county_enrollment.to_csv('outputs/ma_county_enrollment.csv', index=False)
+        ma_county_enrollment = county_enrollment.rename(columns={'ENROLLED': 'MA_ENROLLED'})
+
+    # The dashboard reads the Parquet copy
+    ma_county_enrollment = ma_county_enrollment.astype({'MA_ENROLLED': 'int64'})
+    ma_county_enrollment.to_csv('outputs/ma_county_enrollment.csv', index=False)
+    ma_county_enrollment.to_parquet('outputs/ma_county_enrollment.parquet', engine='pyarrow', compression='zstd', index=False)
+    print("Saved Total MA Enrollment to 'outputs/ma_county_enrollment.csv' and 'outputs/ma_county_enrollment.parquet'")
 
     # 3. Load Provider Data
     # Use chunking if file is huge, but let's try reading relevant columns first
@@ -59,17 +64,65 @@ def process_provider_data():
         return
 
     print("Reading provider data...")
-    # Check text encoding? Default utf-8 usually works or latin1
-    try:
-        df_prov = pd.read_csv(provider_file, usecols=cols, low_memory=False, encoding='ISO-8859-1') # CMS data often has encoding issues
-    except:
-        df_prov = pd.read_csv(provider_file, usecols=cols, low_memory=False)
+    # Lazily scan the national file through a pyarrow dataset, since CMS data is latin-1 and
+    # Polars' own csv reader only decodes utf8; column selection and filters still push down
+    # Every column is typed up front: pyarrow otherwise infers types from the first block only,
+    # which breaks mid-file if e.g. a name column is empty there or the payments are all whole numbers.
+    # Zips are read as text so leading zeros survive and no numeric column has to be re-stringified
+    column_types = {
+        'Rndrng_NPI': pa.int64(),
+        'Rndrng_Prvdr_Last_Org_Name': pa.string(),
+        'Rndrng_Prvdr_First_Name': pa.string(),
+        'Rndrng_Prvdr_Zip5': pa.string(),
+        'Rndrng_Prvdr_State_Abrvtn': pa.string(),
+        'Rndrng_Prvdr_Type': pa.string(),
+        'Tot_Benes': pa.int64(),
+        'Tot_Mdcr_Pymt_Amt': pa.float64(),
+    }
+    provider_ds = ds.dataset(provider_file, format=ds.CsvFileFormat(
+        read_options=pacsv.ReadOptions(encoding='latin-1'),
+        convert_options=pacsv.ConvertOptions(column_types=column_types),
+    ))
+    provider_lf = pl.scan_pyarrow_dataset(provider_ds).select(cols)
 
-    print(f"Total Providers loaded: {len(df_prov)}")
+    # 4. Filter for CA and map Zip to County
+    # The state predicate is pushed into the scan so non-CA rows are never built
+    # Zip is already a string; ensure it is 5 digits, then join its county from zip_map
+    # The pyarrow scan is not shared between plans, so the CA rows are collected once and reused below
+    ca_df = (
+        provider_lf.filter(pl.col('Rndrng_Prvdr_State_Abrvtn') == 'CA')
+        .with_columns(pl.col('Rndrng_Prvdr_Zip5').str.zfill(5).alias('zipcode'))
+        .join(zip_map_lf, on='zipcode', how='left', maintain_order='left')
+        .collect()
+    )
+
+    # Filter for Target Counties, keeping the detailed columns used for Dashboard Interactivity
+    keep_cols = ['Rndrng_NPI', 'Rndrng_Prvdr_Last_Org_Name', 'Rndrng_Prvdr_First_Name', 
+                 'Rndrng_Prvdr_Type', 'county', 'zipcode', 'Tot_Mdcr_Pymt_Amt', 'Tot_Benes']
+    df_target = ca_df.filter(pl.col('county').is_in(top_counties)).select(keep_cols)
+
+    # --- KPI CALCULATIONS (STATE BENCHMARKS ONLY) ---
     
+    # We only need pre-calculated STATE stats. Local stats will be dynamic in Dash.
+    # Calculate weighted average cost per bene for CA (All CA providers)
+    ca_specialty = (
+        ca_df.filter(pl.col('Rndrng_Prvdr_Type').is_not_null())
+        .group_by('Rndrng_Prvdr_Type')
+        .agg(pl.col('Tot_Mdcr_Pymt_Amt').sum(), pl.col('Tot_Benes').sum())
+        .with_columns((pl.col('Tot_Mdcr_Pymt_Amt') / pl.col('Tot_Benes')).alias('State_Avg_Cost'))
+        .sort('Rndrng_Prvdr_Type')
+    )
+
     # --- National Provider Count ---
-    # Count unique NPIs in the entire file (National)
-    national_provider_count = df_prov['Rndrng_NPI'].nunique()
+    # Count unique NPIs in the entire file (National) without materializing it.
+    # This is a second pass over the csv, but only the NPI column is projected and converted.
+    national_counts = provider_lf.select(
+        pl.len().alias('rows'),
+        pl.col('Rndrng_NPI').n_unique().alias('npis'),
+    ).collect()
+    print(f"Total Providers loaded: {national_counts['rows'][0]}")
+
+    national_provider_count = national_counts['npis'][0]
     print(f"National Provider Count: {national_provider_count}")
     
     # Save National Stats
@@ -77,7 +130,7 @@ def process_provider_data():
     nat_stats = [{'Metric': 'National_Provider_Count', 'Value': national_provider_count}]
     
     try:
-        nat_enrl_df = pd.read_csv('outputs/MA_Enrollment_National.csv')
+        nat_enrl_df = pd.read_csv('outputs/MA_Enrollment_National.csv', engine='pyarrow')
         latest_nat_enrl = nat_enrl_df.sort_values('DATE').iloc[-1]['NATIONAL_MA_ENROLLED']
         nat_stats.append({'Metric': 'National_MA_Enrollment', 'Value': latest_nat_enrl})
         
@@ -89,42 +142,23 @@ def process_provider_data():
     except Exception as e:
         print(f"Could not calc National Density (Enrollment file missing?): {e}")
 
-    pd.DataFrame(nat_stats).to_csv('outputs/national_stats.csv', index=False)
+    nat_stats_df = pd.DataFrame(nat_stats).astype({'Value': 'float64'})
+    nat_stats_df.to_csv('outputs/national_stats.csv', index=False)
+    nat_stats_df.to_parquet('outputs/national_stats.parquet', engine='pyarrow', compression='zstd', index=False)
     # -------------------------------
 
-    # 4. Filter for CA
-    df_ca = df_prov[df_prov['Rndrng_Prvdr_State_Abrvtn'] == 'CA'].copy()
-    print(f"CA Providers: {len(df_ca)}")
-    
-    # 5. Map Zip to County
-    # Ensure Zip is string and 5 digits
-    df_ca['zipcode'] = df_ca['Rndrng_Prvdr_Zip5'].astype(str).str.zfill(5)
-    
-    # Merge
-    # zip_map has 'zipcode', 'county'
-    df_merged = pd.merge(df_ca, zip_map[['zipcode', 'county']], on='zipcode', how='left')
-    
-    # Filter for Target Counties
-    df_target = df_merged[df_merged['county'].isin(top_counties)].copy()
+    print(f"CA Providers: {len(ca_df)}")
     print(f"Providers in Target Counties: {len(df_target)}")
-    
-    # Save Detailed Data for Dashboard Interactivity
-    # Columns to keep
-    keep_cols = ['Rndrng_NPI', 'Rndrng_Prvdr_Last_Org_Name', 'Rndrng_Prvdr_First_Name', 
-                 'Rndrng_Prvdr_Type', 'county', 'zipcode', 'Tot_Mdcr_Pymt_Amt', 'Tot_Benes']
-    
-    df_target[keep_cols].to_csv('outputs/provider_data_detailed.csv', index=False)
+
+    df_target.write_csv('outputs/provider_data_detailed.csv')
     print("Saved detailed provider data to 'outputs/provider_data_detailed.csv'")
 
-    # --- KPI CALCULATIONS (STATE BENCHMARKS ONLY) ---
-    
-    # We only need pre-calculated STATE stats. Local stats will be dynamic in Dash.
-    # Calculate weighted average cost per bene for CA (All CA providers)
-    ca_specialty = df_merged.groupby('Rndrng_Prvdr_Type')[['Tot_Mdcr_Pymt_Amt', 'Tot_Benes']].sum().reset_index()
-    ca_specialty['State_Avg_Cost'] = ca_specialty['Tot_Mdcr_Pymt_Amt'] / ca_specialty['Tot_Benes']
-    
-    ca_specialty.to_csv('outputs/kpi_state_benchmarks.csv', index=False)
-    print("Saved state benchmarks to 'outputs/kpi_state_benchmarks.csv'")
+    ca_specialty.write_csv('outputs/kpi_state_benchmarks.csv')
+    ca_specialty.write_parquet('outputs/kpi_state_benchmarks.parquet', compression='zstd')
+    print("Saved state benchmarks to 'outputs/kpi_state_benchmarks.csv' and 'outputs/kpi_state_benchmarks.parquet'")
+
+    # Rebuild the county/specialty KPIs the dashboard reads so they never lag behind this run
+    build_kpis(df_target.to_pandas())
     
     print("Processing complete.")
 
@@ -0,0 +1,30 @@
+## ONE-TIME SCRIPT TO SHRINK THE CA COUNTIES GEOJSON USED BY THE DASHBOARD MAP
+## Build-time only: needs `pip install topojson`, which the dashboard itself does not use
+
+import json
+from urllib.request import urlopen
+
+import topojson
+
+def simplify_geojson(tolerance=0.005):
+    url = 'https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/california-counties.geojson'
+    print(f"Downloading GeoJSON from {url}...")
+    with urlopen(url) as response:
+        geojson = json.load(response)
+
+    # Simplify through a topology so neighboring counties keep shared borders
+    # (Douglas-Peucker, tolerance in degrees)
+    topo = topojson.Topology(geojson, toposimplify=tolerance, prevent_oversimplify=True)
+    simplified = json.loads(topo.to_geojson())
+
+    # Only the county name is used by the dashboard
+    for feature in simplified['features']:
+        feature['properties'] = {'name': feature['properties']['name']}
+        feature.pop('id', None)
+
+    with open('outputs/ca_counties_min.geojson', 'w') as f:
+        json.dump(simplified, f, separators=(',', ':'))
+    print(f"Saved {len(simplified['features'])} counties to 'outputs/ca_counties_min.geojson'")
+
+if __name__ == "__main__":
+    simplify_geojson()
@@ -1,43 +1,53 @@
 
 import pandas as pd
 import json
+import os
 from urllib.request import urlopen
 
 # Load Enrollment Data
 try:
     print("Loading enrollment data...")
-    df = pd.read_excel('outputs/Combined enrollment.xlsx', engine='openpyxl')
+    df = pd.read_parquet('outputs/Combined enrollment.parquet', columns=['COUNTY'])
     unique_counties = sorted(df['COUNTY'].unique().astype(str))
-    print(f"Loaded {len(unique_counties)} unique counties from Excel.")
+    print(f"Loaded {len(unique_counties)} unique counties from enrollment data.")
     print("Sample counties:", unique_counties[:5])
 except Exception as e:
-    print(f"Error loading Excel: {e}")
+    print(f"Error loading enrollment data: {e}")
     unique_counties = []
 
-# Load GeoJSON
+# Load GeoJSON county names (cached to disk after the first download)
 try:
     print("\nLoading GeoJSON...")
-    url = 'https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/california-counties.geojson'
-    with urlopen(url) as response:
-        geojson = json.load(response)
-    
-    geojson_names = sorted([feature['properties']['name'] for feature in geojson['features']])
+    names_path = 'outputs/ca_county_names.json'
+    if os.path.exists(names_path):
+        with open(names_path) as f:
+            geojson_names = json.load(f)
+    else:
+        url = 'https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/california-counties.geojson'
+        with urlopen(url) as response:
+            geojson = json.load(response)
+        geojson_names = sorted(feature['properties']['name'] for feature in geojson['features'])
+        with open(names_path, 'w') as f:
+            json.dump(geojson_names, f)
+
     print(f"Loaded {len(geojson_names)} counties from GeoJSON.")
     print("Sample GeoJSON names:", geojson_names[:5])
     
     # Check intersection
-    intersection = set(unique_counties).intersection(set(geojson_names))
+    enrollment_set = set(unique_counties)
+    geojson_set = set(geojson_names)
+    intersection = enrollment_set & geojson_set
     print(f"\nMatching counties: {len(intersection)}")
     
-    missing_in_geojson = set(unique_counties) - set(geojson_names)
+    missing_in_geojson = enrollment_set - geojson_set
     if missing_in_geojson:
-        print(f"Counties in Excel but NOT in GeoJSON: {len(missing_in_geojson)}")
+        print(f"Counties in enrollment data but NOT in GeoJSON: {len(missing_in_geojson)}")
         print(list(missing_in_geojson)[:10])
     
-    missing_in_excel = set(geojson_names) - set(unique_counties)
-    if missing_in_excel:
-        print(f"Counties in GeoJSON but NOT in Excel: {len(missing_in_excel)}")
-        print(list(missing_in_excel)[:10])
+    missing_in_enrollment = geojson_set - enrollment_set
+    if missing_in_enrollment:
+        print(f"Counties in GeoJSON but NOT in enrollment data: {len(missing_in_enrollment)}")
+        print(list(missing_in_enrollment)[:10])
 
 except Exception as e:
     print(f"Error loading GeoJSON: {e}")